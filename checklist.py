@@ -1,21 +1,21 @@
 #!/usr/bin/env python3
-import json
-import queue
-from datetime import datetime
-from multiprocessing import Process, Manager
+import asyncio
 from typing import Optional
 import os
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
 from communication.android import AndroidLink, AndroidMessage
 from communication.stm32 import STMLink
 from consts import SYMBOL_MAP
 from logger import prepare_logger
-from settings import API_IP, API_IP_START, API_PORT
+from settings import API_IP, API_IP_START, API_IP_END, API_PORT, CAMERA_RESOLUTION
 import socket
 from picamera2 import Picamera2
 from libcamera import Transform
-import cv2
 import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 class PiAction:
@@ -40,11 +40,40 @@ class PiAction:
         return self._value
 
 
+class ClearableQueue(asyncio.Queue):
+    """
+    asyncio.Queue that can be emptied in one call, and filled from a whole list at once.
+    """
+
+    def put_many(self, items):
+        """
+        Queues every item in order, without blocking.
+        """
+        for item in items:
+            self.put_nowait(item)
+
+    def clear(self):
+        """
+        Drops every queued item, keeping the same queue object so tasks waiting on it are unaffected.
+        Dropped items are marked done, so join() does not wait for them.
+        """
+        while True:
+            try:
+                self.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            self.task_done()
+
+
 class RaspberryPi:
     """
     Class that represents the Raspberry Pi.
+    All tasks run as coroutines on a single asyncio event loop, so shared state needs no IPC.
     """
 
+    # Commands that are sent straight to STM32
+    _STM_PREFIXES = ("FW", "BW", "FL", "FR", "BL", "BR", "RS")
+
     def __init__(self):
         """
         Initializes the Raspberry Pi.
@@ -52,187 +81,280 @@ class RaspberryPi:
         self.logger = prepare_logger()
         self.android_link = AndroidLink()
         self.stm_link = STMLink()
+        self._stm_handlers = {"ACK": self._on_stm_ack, "SNA": self._on_stm_snap}
 
-        self.manager = Manager()
-
-        self.android_dropped = self.manager.Event()
-        self.unpause = self.manager.Event()
+        # Created in _main(), as asyncio primitives must be bound to the running loop
+        self.android_dropped: Optional[asyncio.Event] = None
+        self.unpause: Optional[asyncio.Event] = None
 
-        self.movement_lock = self.manager.Lock()
+        self.movement_lock: Optional[asyncio.Lock] = None
 
-        self.android_queue = self.manager.Queue()  # Messages to send to Android
+        self.android_queue: Optional[asyncio.Queue] = None  # Messages to send to Android
         # Messages that need to be processed by RPi
-        self.rpi_action_queue = self.manager.Queue()
+        self.rpi_action_queue: Optional[asyncio.Queue] = None
         # Messages that need to be processed by STM32, as well as snap commands
-        self.command_queue = self.manager.Queue()
+        self.command_queue: Optional[ClearableQueue] = None
         # X,Y,D coordinates of the robot after execution of a command
-        self.path_queue = self.manager.Queue()
+        self.path_queue: Optional[ClearableQueue] = None
 
-        self.proc_recv_android = None
-        self.proc_recv_stm32 = None
-        self.proc_android_sender = None
-        self.proc_command_follower = None
-        self.proc_rpi_action = None
+        self.task_recv_android = None
+        self.task_recv_stm32 = None
+        self.task_android_sender = None
+        self.task_command_follower = None
+        self.task_rpi_action = None
         self.rs_flag = False
-        self.success_obstacles = self.manager.list()
-        self.failed_obstacles = self.manager.list()
-        self.obstacles = self.manager.dict()
-        self.current_location = self.manager.dict()
+        self.success_obstacles = []
+        self.failed_obstacles = []
+        self.obstacles = {}
+        self.current_location = {}
+        self._pending_location = None
         self.failed_attempt = False
+        # Created when the robot re-attempts failed obstacles, lets commands through without unpause
+        self.retrylock: Optional[asyncio.Lock] = None
         
         # Create a global Camera Instance
         self.camera = None
-        #self.initialize_camera()
+        self.initialize_camera()
         self.valid_api = None
 
+        # Reuse one HTTP connection to the API across requests, with a few spare for overlapping calls
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
     def start(self):
         """Starts the RPi orchestrator"""
         try:
-            ### Start up initialization ###
-
-            #self.android_link.connect()
-            #self.android_queue.put(AndroidMessage('info', 'You are connected to the RPi!'))
-            self.stm_link.connect()
-            
-            for endpoint in API_IP_START:
-                self.valid_api = API_IP + str(endpoint)  
-                if self.check_api():
-                    self.logger.debug("API successfully set up at", self.valid_api)
-                    break
-                
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            self.stop()
 
-            # Define child processes
-            #self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
-            #self.proc_android_sender = Process(target=self.android_sender)
-            #self.proc_command_follower = Process(target=self.command_follower)
-            #self.proc_rpi_action = Process(target=self.rpi_action)
+    async def _main(self):
+        """Sets up the links and runs all the tasks on the event loop until they exit"""
+        ### Start up initialization ###
+        self.android_dropped = asyncio.Event()
+        self.unpause = asyncio.Event()
+        self.movement_lock = asyncio.Lock()
+        self.android_queue = asyncio.Queue()
+        self.rpi_action_queue = asyncio.Queue()
+        self.command_queue = ClearableQueue()
+        self.path_queue = ClearableQueue()
+
+        #await asyncio.to_thread(self.android_link.connect)
+        #self.android_queue.put_nowait(AndroidMessage('info', 'You are connected to the RPi!'))
+        self.stm_link.connect()
+
+        self.valid_api = await asyncio.to_thread(self.discover_api)
+        if self.valid_api is not None:
+            self.logger.debug(f"API successfully set up at {self.valid_api}")
+        else:
+            self.logger.error("No API found on any of the candidate addresses!")
 
-            # Start child processes
-            #self.proc_recv_android.start()
-            self.proc_recv_stm32.start()
-            #self.proc_android_sender.start()
-            #self.proc_command_follower.start()
-            #self.proc_rpi_action.start()
-            #self.rpi_action_queue.put(PiAction(cat="control", value={}))
+        # Define and start tasks
+        #self.task_recv_android = asyncio.create_task(self.recv_android())
+        self.task_recv_stm32 = asyncio.create_task(self.recv_stm())
+        #self.task_android_sender = asyncio.create_task(self.android_sender())
+        #self.task_command_follower = asyncio.create_task(self.command_follower())
+        #self.task_rpi_action = asyncio.create_task(self.rpi_action())
+        #self.rpi_action_queue.put_nowait(PiAction(cat="control", value={}))
 
-            self.logger.info("Child Processes started")
+        self.logger.info("Tasks started")
 
-            ### Start up complete ###
+        ### Start up complete ###
 
-            # Send success message to Android
-            #self.android_queue.put(AndroidMessage('info', 'Robot is ready!'))
-            #self.android_queue.put(AndroidMessage('mode', 'path'))
-            #self.reconnect_android()
+        # Send success message to Android
+        #self.android_queue.put_nowait(AndroidMessage('info', 'Robot is ready!'))
+        #self.android_queue.put_nowait(AndroidMessage('mode', 'path'))
+        #await self.reconnect_android()
 
-        except KeyboardInterrupt:
-            self.stop()
+        tasks = [task for task in (self.task_recv_android, self.task_recv_stm32, self.task_android_sender,
+                                   self.task_command_follower, self.task_rpi_action) if task is not None]
+        await asyncio.gather(*tasks)
 
     def stop(self):
         """Stops all processes on the RPi and disconnects gracefully with Android and STM32"""
-        #self.android_link.disconnect()
-        self.stm_link.disconnect()
+        try:
+            #self.android_link.disconnect()
+            self.stm_link.disconnect()
+        finally:
+            self.close_camera()
         self.logger.info("Program exited!")    
 
     
-    def recv_stm(self) -> None:
+    def initialize_camera(self) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        Opens the camera once and keeps it streaming, so that each snap only has to grab a frame.
         """
-        while True:
+        width, height = CAMERA_RESOLUTION
+        self.camera = Picamera2()
+        try:
+            still_config = self.camera.create_still_configuration(
+                main={"size": (width, height), "format": "RGB888"}, buffer_count=2)
+            self.camera.configure(still_config)
+            self.camera.options["quality"] = 85
+            self.camera.start()
+        except Exception:
+            # Do not leave a half-initialized camera holding the device
+            self.close_camera()
+            raise
+        self.logger.info("Camera initialized.")
 
-            message: str = self.stm_link.recv()
+    def close_camera(self) -> None:
+        """
+        Stops and releases the camera, if it is open.
+        """
+        if self.camera is None:
+            return
+        try:
+            self.camera.stop()
+            self.camera.close()
+        finally:
+            self.camera = None
 
-            if message.startswith("ACK"):
-                if self.rs_flag == False:
-                    self.rs_flag = True
-                    self.logger.debug("ACK for RS00 from STM32 received.")
-                    continue
-                try:
-                    #if self.movement_lock.acquire(timeout=5):
-                    self.movement_lock.release()
-                    self.logger.debug("Movement lock released after ACK received!")
-                    #self.logger.debug("Movement lock released!")
-                    try:
-                        self.retrylock.release()
-                    except:
-                        self.logger.debug("Failed to release retry lock")
-                        pass
-
-                    cur_location = self.path_queue.get_nowait()
-
-                    self.current_location['x'] = cur_location['x']
-                    self.current_location['y'] = cur_location['y']
-                    self.current_location['d'] = cur_location['d']
-                    # Update the current robot location
-                    self.logger.info(
-                        f"Current location = {self.current_location}")
-                    # Send the new robot location to Andriod to be updated on the screen
-                    self.android_queue.put(AndroidMessage('location', {
-                        "x": cur_location['x'],
-                        "y": cur_location['y'],
-                        "d": cur_location['d'],
-                    }))
-                    
-                    
-                except:
-                    self.logger.warning("Tried to release a released lock!")
-            elif message.startswith("SNAP"):
-                self.logger.info("Sending API requests to image server")
-                _, obstacle_id = message.split('_')
-                self.snap_and_rec(obstacle_id)
-            else:
-                self.logger.warning(
-                    f"Ignored unknown message from STM: {message}")
+    async def recv_stm(self) -> None:
+        """
+        [Task] Receive acknowledgement messages from STM32, and release the movement lock.
+        Everything the STM32 has sent is drained in one read whenever the serial link is readable,
+        and the messages are handled as a batch.
+        """
+        loop = asyncio.get_running_loop()
+        pending = []
+        errors = []
+        readable = asyncio.Event()
 
-    def android_sender(self) -> None:
+        def on_readable():
+            try:
+                pending.extend(self.stm_link.recv_available())
+            except Exception as e:
+                # Stop watching the link, and fail this task rather than have the loop swallow the error
+                loop.remove_reader(self.stm_link.fileno())
+                errors.append(e)
+                readable.set()
+                return
+            if pending:
+                readable.set()
+
+        loop.add_reader(self.stm_link.fileno(), on_readable)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                if errors:
+                    raise errors[0]
+                messages = pending.copy()
+                pending.clear()
+                await self.handle_stm_messages(messages)
+        finally:
+            loop.remove_reader(self.stm_link.fileno())
+
+    async def handle_stm_messages(self, messages) -> None:
+        """
+        Handles a batch of messages from STM32. When several ACKs arrive together,
+        only the last location reached is published.
+        :param messages: messages received from STM32, in order
+        """
+        for message in messages:
+            # The first three characters identify the message: ACK or SNAP_<obstacle id>
+            await self._stm_handlers.get(message[:3], self._on_stm_unknown)(message)
+        self.flush_location()
+
+    async def _on_stm_ack(self, message: str) -> None:
+        """STM32 finished a command: release the movement lock and note the location reached"""
+        if self.rs_flag == False:
+            self.rs_flag = True
+            self.logger.debug("ACK for RS00 from STM32 received.")
+            return
+        if not self.movement_lock.locked():
+            self.logger.warning("Tried to release a released lock!")
+            return
+        #if self.movement_lock.acquire(timeout=5):
+        self.movement_lock.release()
+        self.logger.debug("Movement lock released after ACK received!")
+        #self.logger.debug("Movement lock released!")
+        if self.retrylock is not None and self.retrylock.locked():
+            self.retrylock.release()
+
+        if not self.path_queue.empty():
+            self._pending_location = self.path_queue.get_nowait()
+
+    async def _on_stm_snap(self, message: str) -> None:
+        """STM32 is in position at an obstacle: snap and run image-rec"""
+        # Publish the location reached so far before yielding to other tasks
+        self.flush_location()
+        self.logger.info("Sending API requests to image server")
+        _, obstacle_id = message.split('_', 1)
+        await self.snap_and_rec(obstacle_id)
+
+    async def _on_stm_unknown(self, message: str) -> None:
+        self.logger.warning(
+            f"Ignored unknown message from STM: {message}")
+
+    def flush_location(self) -> None:
+        """Publishes the latest location reached from the ACKs handled so far, if any"""
+        if self._pending_location is not None:
+            self.update_location(self._pending_location)
+            self._pending_location = None
+
+    def update_location(self, cur_location) -> None:
         """
-        [Child process] Responsible for retrieving messages from android_queue and sending them over the Android link. 
+        Updates the current robot location and sends it to Android
+        :param cur_location: the location reached, as a dict of x, y and d
+        """
+        self.current_location['x'] = cur_location['x']
+        self.current_location['y'] = cur_location['y']
+        self.current_location['d'] = cur_location['d']
+        # Update the current robot location
+        self.logger.info(
+            f"Current location = {self.current_location}")
+        # Send the new robot location to Andriod to be updated on the screen
+        self.android_queue.put_nowait(AndroidMessage('location', {
+            "x": cur_location['x'],
+            "y": cur_location['y'],
+            "d": cur_location['d'],
+        }))
+
+    async def android_sender(self) -> None:
+        """
+        [Task] Responsible for retrieving messages from android_queue and sending them over the Android link. 
         """
         while True:
-            # Retrieve from queue
-            try:
-                message: AndroidMessage = self.android_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
+            # Sleep until there is a message to send
+            message: AndroidMessage = await self.android_queue.get()
 
             try:
-                self.android_link.send(message)
+                await asyncio.to_thread(self.android_link.send, message)
             except OSError:
                 self.android_dropped.set()
                 self.logger.debug("Event set: Android dropped")
 
-    def command_follower(self) -> None:
+    async def command_follower(self) -> None:
         """
-        [Child Process] 
+        [Task] 
         """
         while True:
             # Retrieve next movement command
             
-            try:
-                command: str = self.command_queue.get()
-                self.logger.debug(f"Next Command: {command}")
-            except:
-                self.logger.debug("Error getting the next command")
+            command: str = await self.command_queue.get()
+            self.logger.debug(f"Next Command: {command}")
             self.logger.debug(f"wait for unpause - {command}")
-            # Wait for unpause event to be true [Main Trigger]
-            try:
-                self.logger.debug(f"Trying to acquire retrylock - {command}")
-                self.retrylock.acquire(timeout=1)
-                self.retrylock.release()
-                self.logger.debug(f"Acquired retrylock - {command}")
-            except:
-                self.logger.debug(f"Fail to acquire retry lock - {command}")
-                self.unpause.wait()
+            # Wait for unpause event to be true [Main Trigger], unless re-attempting failed obstacles
+            if self.retrylock is None:
+                await self.unpause.wait()
+            else:
+                try:
+                    self.logger.debug(f"Trying to acquire retrylock - {command}")
+                    await asyncio.wait_for(self.retrylock.acquire(), timeout=1)
+                    self.retrylock.release()
+                    self.logger.debug(f"Acquired retrylock - {command}")
+                except asyncio.TimeoutError:
+                    self.logger.debug(f"Fail to acquire retry lock - {command}")
+                    await self.unpause.wait()
             self.logger.debug(f"wait for movelock - {command}")
             # Acquire lock first (needed for both moving, and snapping pictures)
-            self.movement_lock.acquire()
+            await self.movement_lock.acquire()
             self.logger.debug(f"Movement lock acquired! - {command}")
             
             # STM32 Commands - Send straight to STM32
-            stm32_prefixes = ("FW", "BW", "FL", "FR", "BL",
-                              "BR", "RS")
-            if command.startswith(stm32_prefixes):
+            if command.startswith(self._STM_PREFIXES):
                     self.stm_link.send(command) 
                     self.logger.debug(f"Sending to STM32:{command}")
 
@@ -240,7 +362,7 @@ class RaspberryPi:
             elif command.startswith("SNAP"):
                 obstacle_id_with_signal = command.replace("SNAP", "")
 
-                self.rpi_action_queue.put(
+                self.rpi_action_queue.put_nowait(
                     PiAction(cat="snap", value=obstacle_id_with_signal))
 
             # End of path
@@ -259,44 +381,58 @@ class RaspberryPi:
 
                     self.logger.info("Attempting to go to failed obstacles")
                     self.failed_attempt = True
-                    self.request_algo({'obstacles': new_obstacle_list, 'mode': '0'},
+                    await self.request_algo({'obstacles': new_obstacle_list, 'mode': '0'},
                                         self.current_location['x'], self.current_location['y'], self.current_location['d'], retrying=True)
-                    self.retrylock = self.manager.Lock()
+                    self.retrylock = asyncio.Lock()
                     self.movement_lock.release()
                     continue
 
                 self.unpause.clear()
                 self.movement_lock.release()
                 self.logger.info("Commands queue finished.")
-                #self.android_queue.put(AndroidMessage(
+                #self.android_queue.put_nowait(AndroidMessage(
                     #"info", "Commands queue finished."))
-                #self.android_queue.put(AndroidMessage("status", "finished"))
-                #self.rpi_action_queue.put(PiAction(cat="stitch", value=""))
+                #self.android_queue.put_nowait(AndroidMessage("status", "finished"))
+                #self.rpi_action_queue.put_nowait(PiAction(cat="stitch", value=""))
             else:
                 raise Exception(f"Unknown command: {command}")
 
                 
 
-    def rpi_action(self):
+    async def rpi_action(self):
         """
-        [Child Process] 
+        [Task] 
         """
         while True:
-            action: PiAction = self.rpi_action_queue.get()
+            action: PiAction = await self.rpi_action_queue.get()
             self.logger.debug(
                 f"PiAction retrieved from queue: {action.cat} {action.value}")
 
             if action.cat == "obstacles":
                 for obs in action.value['obstacles']:
                     self.obstacles[obs['obstacleNumber']] = obs
-                self.request_algo(action.value)
+                await self.request_algo(action.value)
             elif action.cat == "snap":
-                self.snap_and_rec(obstacle_id_with_signal=action.value)
+                await self.snap_and_rec(action.value)
             elif action.cat == "stitch":
-                self.request_stitch()
+                await self.request_stitch()
                 
            
-    def snap_and_rec(self, obstacle_id: str) -> None:
+    def capture_image(self) -> io.BytesIO:
+        """
+        Snaps an image and JPEG-encodes it in memory. Blocking, so run it off the event loop.
+        :return: the encoded image
+        """
+        if self.camera is None:
+            self.initialize_camera()
+
+        # Let picamera2 encode the captured frame in memory rather than writing to the SD card
+        image_buf = io.BytesIO()
+        self.camera.capture_file(image_buf, format="jpeg")
+        image_buf.seek(0)
+        return image_buf
+
+    async def snap_and_rec(self, obstacle_id: str) -> None:
         """
         RPi snaps an image and calls the API for image-rec.
         The response is then forwarded back to the android
@@ -304,51 +440,40 @@ class RaspberryPi:
         """
         #obstacle_id, signal = obstacle_id_with_signal.split('_')
         self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
-        #self.android_queue.put(AndroidMessage("info", f"Capturing image for obstacle id: {obstacle_id}"))
+        #self.android_queue.put_nowait(AndroidMessage("info", f"Capturing image for obstacle id: {obstacle_id}"))
 
         try:
-            # Initialize and configure the camera each time
-            self.camera = Picamera2()
-            camera_config = self.camera.create_still_configuration()
-            self.camera.configure(camera_config)
-            self.camera.start()
-
-            # Capture the image
-            frame = self.camera.capture_array()
-            file_path = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{obstacle_id}.jpg'
-            cv2.imwrite(file_path, frame)
-            self.logger.info("Image captured and saved.")
-
-            # Stop and release the camera
-            self.camera.stop()
-            self.camera.close()
+            image_buf = await asyncio.to_thread(self.capture_image)
+            self.logger.info("Image captured and encoded.")
         except Exception as e:
             self.logger.error(f"Error capturing image: {str(e)}")
-            #self.android_queue.put(AndroidMessage("error", "Failed to capture image."))
+            #self.android_queue.put_nowait(AndroidMessage("error", "Failed to capture image."))
             return
         
         # Proceed with sending the image to the API
         url = f"http://{self.valid_api}:{API_PORT}/image"
                 
-        img_file = {'files': (file_path, open(file_path, 'rb'), 'image/jpeg')}
-        data = {'obstacle_id': str(obstacle_id), 'signal': 'L'}
+        # Stream the multipart body from the encoded image instead of building a copy of it in memory
+        body = MultipartEncoder(fields={'obstacle_id': str(obstacle_id), 'signal': 'L',
+                                        'files': (f"{obstacle_id}.jpg", image_buf, 'image/jpeg')})
             
-        response = requests.post(url, files=img_file, data=data)
-        img_file['files'][1].close()
+        response = await asyncio.to_thread(self.http.post, url, data=body,
+                                           headers={'Content-Type': body.content_type})
+        image_buf.close()
         if response.status_code == 200:
             self.logger.info("Image-rec API called successfully.")
         else:
             self.logger.error(f"Failed to call image-rec API: {response.status_code}")
 
 
-        results = json.loads(response.content)
+        results = orjson.loads(response.content)
 
         # for stopping the robot upon finding a non-bullseye face (checklist: navigating around obstacle)
         if results.get("stop"):
             # stop issuing commands
 
             self.logger.info("Found non-bullseye face, remaining commands and path cleared.")
-            #self.android_queue.put(AndroidMessage("info", "Found non-bullseye face, remaining commands cleared."))
+            #self.android_queue.put_nowait(AndroidMessage("info", "Found non-bullseye face, remaining commands cleared."))
             self.logger.info(f"Image recognition results: {results} ({SYMBOL_MAP.get(results['image_id'])})")
 
         # No results from the model
@@ -359,42 +484,77 @@ class RaspberryPi:
             self.stm_link.send("asdd")
 
         # notify android of image-rec results
-        #self.android_queue.put(AndroidMessage("image-rec", results))
+        #self.android_queue.put_nowait(AndroidMessage("image-rec", results))
 
-    def request_stitch(self):
+    async def request_stitch(self):
         """Sends a stitch request to the image recognition API to stitch the different images together"""
         url = f"http://{self.valid_api}:{API_PORT}/stitch"
-        response = requests.get(url)
+        response = await asyncio.to_thread(self.http.get, url)
 
         # If error, then log, and send error to Android
         if response.status_code != 200:
             # Notify android
-            self.android_queue.put(AndroidMessage(
+            self.android_queue.put_nowait(AndroidMessage(
                 "error", "Something went wrong when requesting stitch from the API."))
             self.logger.error(
                 "Something went wrong when requesting stitch from the API.")
             return
 
         self.logger.info("Images stitched!")
-        self.android_queue.put(AndroidMessage("info", "Images stitched!"))
+        self.android_queue.put_nowait(AndroidMessage("info", "Images stitched!"))
 
     def clear_queues(self):
         """Clear both command and path queues"""
-        while not self.command_queue.empty():
-            self.command_queue.get()
-        while not self.path_queue.empty():
-            self.path_queue.get()
+        self.command_queue.clear()
+        self.path_queue.clear()
+
+    def discover_api(self) -> Optional[str]:
+        """Probe every candidate API address at once and return the first one that is up
 
-    def check_api(self) -> bool:
+        Returns:
+            Optional[str]: IP address of the API server, or None if none responded.
+        """
+        candidates = [API_IP + str(endpoint) for endpoint in range(API_IP_START, API_IP_END + 1)]
+        executor = ThreadPoolExecutor(max_workers=min(32, len(candidates)))
+        try:
+            futures = {executor.submit(self._probe_api, host): host for host in candidates}
+            for future in as_completed(futures):
+                if future.result():
+                    return futures[future]
+            return None
+        finally:
+            # Do not wait on the probes that are still timing out
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _probe_api(self, host: str) -> bool:
+        """Check a candidate API address from a discovery thread.
+        A bare TCP connect weeds out dead addresses cheaply; only an open port gets a /status request,
+        on a session of its own, to confirm it is the API.
+        """
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.settimeout(0.3)
+                if sock.connect_ex((host, API_PORT)) != 0:
+                    return False
+        except OSError:
+            return False
+        with requests.Session() as session:
+            return self.check_api(host, session)
+
+    def check_api(self, host: Optional[str] = None, session: Optional[requests.Session] = None) -> bool:
         """Check whether image recognition and algorithm API server is up and running
 
+        Args:
+            host (Optional[str]): IP address to check, defaults to the discovered API.
+            session (Optional[requests.Session]): session to send the request on, defaults to the shared one.
+
         Returns:
             bool: True if running, False if not.
         """
         # Check image recognition API
-        url = f"http://{self.valid_api}:{API_PORT}/status"
+        url = f"http://{host or self.valid_api}:{API_PORT}/status"
         try:
-            response = requests.get(url, timeout=1)
+            response = (session or self.http).get(url, timeout=1)
             if response.status_code == 200:
                 self.logger.debug("API is up!")
                 return True
@@ -410,30 +570,31 @@ class RaspberryPi:
             self.logger.warning(f"API Exception: {e}")
             return False
     
-    def request_algo(self, data, robot_x=1, robot_y=1, robot_dir=0, retrying=False):
+    async def request_algo(self, data, robot_x=1, robot_y=1, robot_dir=0, retrying=False):
         """
         Requests for a series of commands and the path from the Algo API.
         The received commands and path are then queued in the respective queues
         """
         self.logger.info("Requesting path from algo...")
-        self.android_queue.put(AndroidMessage(
+        self.android_queue.put_nowait(AndroidMessage(
             "info", "Requesting path from algo..."))
         self.logger.info(f"data: {data}")
         body = {**data, "big_turn": "0", "robot_x": robot_x,
                 "robot_y": robot_y, "robot_dir": robot_dir, "retrying": retrying}
         url = f"http://{self.valid_api}:{API_PORT}/path"
-        response = requests.post(url, json=body)
+        response = await asyncio.to_thread(self.http.post, url, data=orjson.dumps(body),
+                                           headers={'Content-Type': 'application/json'})
 
         # Error encountered at the server, return early
         if response.status_code != 200:
-            self.android_queue.put(AndroidMessage(
+            self.android_queue.put_nowait(AndroidMessage(
                 "error", "Something went wrong when requesting path from Algo API."))
             self.logger.error(
                 "Something went wrong when requesting path from Algo API.")
             return
 
         # Parse response
-        result = json.loads(response.content)['data']
+        result = orjson.loads(response.content)['data']
         commands = result['commands']
         path = result['path']
         print(response.content)
@@ -443,12 +604,10 @@ class RaspberryPi:
 
         # Put commands and paths into respective queues
         self.clear_queues()
-        for c in commands:
-            self.command_queue.put(c)
-        for p in path[1:]:  # ignore first element as it is the starting position of the robot
-            self.path_queue.put(p)
+        self.command_queue.put_many(commands)
+        self.path_queue.put_many(path[1:])  # ignore first element as it is the starting position of the robot
 
-        self.android_queue.put(AndroidMessage(
+        self.android_queue.put_nowait(AndroidMessage(
             "info", "Commands and path received Algo API. Robot is ready to move."))
         self.logger.info(
             "Commands and path received Algo API. Robot is ready to move.")
@@ -1,7 +1,8 @@
-import json
+import logging
+import orjson
 import os
 import socket
-from typing import Optional
+from typing import List, Optional
 import bluetooth
 from communication.link import Link
 
@@ -19,6 +20,8 @@ class AndroidMessage:
         """
         self._cat = cat
         self._value = value
+        # Serialized here, in the producing process, so android_sender only has to write the bytes out
+        self._wire = orjson.dumps({'cat': cat, 'value': value}) + b"\n"
 
     @property
     def cat(self):
@@ -42,7 +45,26 @@ class AndroidMessage:
         Returns the message as a JSON string.
         :return: JSON string representation of the message.
         """
-        return json.dumps({'cat': self._cat, 'value': self._value})
+        return self._wire[:-1].decode('utf-8')
+
+    @property
+    def wire(self) -> bytes:
+        """
+        Returns the message as it is sent to Android.
+        :return: UTF-8 encoded JSON string representation of the message, terminated by a newline.
+        """
+        return self._wire
+
+
+# Fixed messages sent again and again, so they are built and serialized only once
+MSG_CONNECTED = AndroidMessage('info', 'You are connected to the RPi!')
+MSG_RECONNECTED = AndroidMessage('info', 'You are reconnected!')
+MSG_READY = AndroidMessage('info', 'Robot is ready!')
+MSG_MODE_PATH = AndroidMessage('mode', 'path')
+MSG_MODE_MANUAL = AndroidMessage('mode', 'manual')
+MSG_RUNNING = AndroidMessage('status', 'running')
+MSG_FINISHED = AndroidMessage('status', 'finished')
+MSG_QUEUE_FINISHED = AndroidMessage('info', 'Commands queue finished.')
 
 
 class AndroidLink(Link):
@@ -164,16 +186,34 @@ class AndroidLink(Link):
     def send(self, message: AndroidMessage):
         """Send message to Android"""
         try:
-            self.client_sock.send(f"{message.jsonify}\n".encode("utf-8"))
-            self.logger.debug(f"Sent to Android: {message.jsonify}")
+            self.client_sock.sendall(message.wire)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Sent to Android: %s", message.jsonify)
+        except OSError as e:
+            self.logger.error(f"Error sending message to Android: {e}")
+            raise e
+
+    def send_batch(self, messages: List[AndroidMessage]):
+        """Send several messages to Android in a single write, one per line"""
+        try:
+            self.client_sock.sendall(b"".join(message.wire for message in messages))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                for message in messages:
+                    self.logger.debug("Sent to Android: %s", message.jsonify)
         except OSError as e:
             self.logger.error(f"Error sending message to Android: {e}")
             raise e
 
     def recv(self) -> Optional[str]:
-        """Receive message from Android"""
+        """Receive message from Android
+
+        Raises:
+            OSError: if the connection is broken, or Android has closed it
+        """
         try:
             tmp = self.client_sock.recv(1024)
+            if not tmp:
+                raise ConnectionError("Android closed the Bluetooth link")
             self.logger.debug(tmp)
             message = tmp.strip().decode("utf-8")
             self.logger.debug(f"Received from Android: {message}")
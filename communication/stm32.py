@@ -1,4 +1,5 @@
-from typing import Optional
+import os
+from typing import List, Optional
 import serial
 from communication.link import Link
 from settings import SERIAL_PORT, BAUD_RATE
@@ -38,6 +39,7 @@ class STMLink(Link):
         """
         super().__init__()
         self.serial_link = None
+        self._recv_buf = b""
 
     def connect(self):
         """Connect to STM32 using serial UART connection, given the serial port and the baud rate"""
@@ -48,6 +50,7 @@ class STMLink(Link):
         """Disconnect from STM32 by closing the serial link that was opened during connect()"""
         self.serial_link.close()
         self.serial_link = None
+        self._recv_buf = b""
         self.logger.info("Disconnected from STM32")
 
     def send(self, message: str) -> None:
@@ -57,7 +60,7 @@ class STMLink(Link):
             message (str): message to send
         """
         self.serial_link.write(f"{message}".encode("utf-8"))
-        self.logger.debug(f"Sent to STM32: {message}")
+        self.logger.debug("Sent to STM32: %s", message)
 
     def recv(self) -> Optional[str]:
         """Receive a message from STM32, utf-8 decoded
@@ -66,5 +69,34 @@ class STMLink(Link):
             Optional[str]: message received
         """
         message = self.serial_link.readline().strip().decode("utf-8")
-        self.logger.debug(f"Received from STM32: {message}")
+        self.logger.debug("Received from STM32: %s", message)
         return message
+
+    def fileno(self) -> int:
+        """File descriptor of the serial link, for waiting on it with select or an event loop"""
+        return self.serial_link.fileno()
+
+    def recv_available(self) -> List[str]:
+        """Receive every complete message the STM32 has sent so far, utf-8 decoded, in a single read
+
+        Only call this once the serial link is readable, or it will block. Incomplete trailing
+        messages are kept until the rest arrives, so do not mix this with recv().
+
+        Returns:
+            List[str]: messages received, in order
+
+        Raises:
+            serial.SerialException: if the STM32 has been disconnected
+        """
+        data = os.read(self.fileno(), 4096)
+        if not data:
+            # As pyserial does: a readable port with nothing to read has been unplugged
+            raise serial.SerialException(
+                "device reports readiness to read but returned no data "
+                "(device disconnected or multiple access on port?)")
+        self._recv_buf += data
+        *lines, self._recv_buf = self._recv_buf.split(b"\n")
+        messages = [line.strip().decode("utf-8") for line in lines if line.strip()]
+        for message in messages:
+            self.logger.debug("Received from STM32: %s", message)
+        return messages
@@ -1,9 +1,36 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are, leaving all formatting to the listener thread.
+    The queue never leaves the process, so the records do not need to be made picklable first.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _start_listener(queue_handler: _DeferredQueueHandler, handlers: list) -> logging.handlers.QueueListener:
+    """
+    Points the queue handler at a fresh queue, and starts a thread writing out what is put on it.
+    """
+    queue_handler.queue = queue.Queue()
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
 
 
 def prepare_logger() -> logging.Logger:
     """
     Creates a logger that is able to both print to console and save to file.
+    Records are only queued by the caller; the console and file are written to from a background thread,
+    so logging never blocks on I/O. Each forked child process gets its own thread.
     """
     log_format = logging.Formatter(
         '%(asctime)s :: %(levelname)s :: %(message)s')
@@ -22,8 +49,24 @@ def prepare_logger() -> logging.Logger:
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(log_format)
 
-        # Add handlers to logger
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        # Queue handler, handing records over to the console and file handlers on the listener thread
+        handlers = [console_handler, file_handler]
+        queue_handler = _DeferredQueueHandler(queue.Queue())
+        logger.addHandler(queue_handler)
+        # Write out what is still queued when the program exits
+        atexit.register(_start_listener(queue_handler, handlers).stop)
+
+        listeners = []
+
+        def restart_listener_in_child():
+            # The listener thread does not survive a fork, and the queue may have been mid-put when it happened
+            listeners[:] = [_start_listener(queue_handler, handlers)]
+
+        def stop_listener_on_child_exit(_):
+            # Multiprocessing children skip atexit, but run the finalizers registered once they have started
+            multiprocessing.util.Finalize(None, listeners[0].stop, exitpriority=0)
+
+        os.register_at_fork(after_in_child=restart_listener_in_child)
+        multiprocessing.util.register_after_fork(logger, stop_listener_on_child_exit)
 
     return logger
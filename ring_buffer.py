@@ -0,0 +1,117 @@
+import queue
+import struct
+from multiprocessing import Lock, Semaphore, shared_memory
+from typing import Iterable, Optional
+
+# Every command is stored in a fixed slot, e.g. "FW15"
+SLOT_SIZE = 8
+# Byte offsets into the shared memory. The read and write indices sit on separate cache lines,
+# so the producer and the consumer never write to the same line.
+_READ = 0
+_WRITE = 64
+_DISCARD = 128
+_SLOTS = 192
+
+
+class CommandRing:
+    """
+    Ring buffer of short ASCII commands in shared memory, from any number of producer processes to one
+    consumer process.
+
+    Only the consumer moves the read index, so it never takes a lock, and nothing is pickled. Producers
+    share the write index, so pushing and clearing hold a producer lock, which is uncontended in practice.
+    Waiting for a free or filled slot is done on two semaphores counting them, instead of spinning,
+    which would tie up a core on the Pi.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """
+        Constructor for CommandRing. Create it before forking the producer and consumer processes.
+        :param capacity: Maximum number of commands the ring can hold.
+        """
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(create=True, size=_SLOTS + capacity * SLOT_SIZE)
+        self._shm.buf[:_SLOTS] = bytes(_SLOTS)
+        self._filled = Semaphore(0)
+        self._free = Semaphore(capacity)
+        self._producer = Lock()
+
+    def _load(self, offset: int) -> int:
+        return struct.unpack_from("<Q", self._shm.buf, offset)[0]
+
+    def _store(self, offset: int, value: int) -> None:
+        struct.pack_into("<Q", self._shm.buf, offset, value)
+
+    @staticmethod
+    def _encode(command: str) -> bytes:
+        data = command.encode("ascii")
+        if len(data) > SLOT_SIZE:
+            raise ValueError(f"Command longer than {SLOT_SIZE} bytes: {command}")
+        return data
+
+    def _write(self, data: bytes) -> None:
+        # Caller holds the producer lock and a free slot
+        write = self._load(_WRITE)
+        start = _SLOTS + (write % self.capacity) * SLOT_SIZE
+        self._shm.buf[start:start + SLOT_SIZE] = data.ljust(SLOT_SIZE, b"\0")
+        # Publish the slot only once it is written; the semaphore release orders the two
+        self._store(_WRITE, write + 1)
+        self._filled.release()
+
+    def push(self, command: str) -> None:
+        """
+        [Producer] Adds a command to the ring, waiting for a free slot if it is full.
+        :param command: ASCII command of at most SLOT_SIZE characters.
+        """
+        data = self._encode(command)
+        self._free.acquire()
+        with self._producer:
+            self._write(data)
+
+    def push_many(self, commands: Iterable[str]) -> None:
+        """
+        [Producer] Adds a sequence of commands to the ring under one hold of the producer lock,
+        so no other producer's commands end up in between them.
+        :param commands: ASCII commands of at most SLOT_SIZE characters each.
+        """
+        data = [self._encode(command) for command in commands]
+        with self._producer:
+            for encoded in data:
+                self._free.acquire()
+                self._write(encoded)
+
+    def pop(self, block: bool = True, timeout: Optional[float] = None) -> str:
+        """
+        [Consumer] Removes the oldest command from the ring.
+        :param block: Whether to wait for a command if the ring is empty.
+        :param timeout: How long to wait for, if blocking. Waits forever if None.
+        :return: The command.
+        :raises queue.Empty: If no command was available.
+        """
+        while True:
+            if not self._filled.acquire(block, timeout):
+                raise queue.Empty
+            read = self._load(_READ)
+            start = _SLOTS + (read % self.capacity) * SLOT_SIZE
+            data = bytes(self._shm.buf[start:start + SLOT_SIZE])
+            self._store(_READ, read + 1)
+            self._free.release()
+            # Skip commands dropped by clear()
+            if read >= self._load(_DISCARD):
+                return data.rstrip(b"\0").decode("ascii")
+
+    def clear(self) -> None:
+        """
+        [Producer] Drops every command currently in the ring, in constant time.
+        Rather than touching the consumer's read index, marks everything written so far as
+        discarded; the consumer skips those commands as it reaches them.
+        """
+        with self._producer:
+            self._store(_DISCARD, self._load(_WRITE))
+
+    def close(self) -> None:
+        """
+        Releases the shared memory. Call once, from the process that created the ring.
+        """
+        self._shm.close()
+        self._shm.unlink()
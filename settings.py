@@ -10,3 +10,6 @@ API_PORT = 5005
 
 # ROBOT SETTINGS
 OUTDOOR_BIG_TURN = False
+
+# CAMERA SETTINGS
+CAMERA_RESOLUTION = (1920, 1080)  # (width, height) of captured images
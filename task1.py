@@ -3,6 +3,7 @@ import json
 import queue
 from datetime import datetime
 from multiprocessing import Process, Manager
+from pathlib import Path
 from typing import Optional
 import os
 import requests
@@ -423,13 +424,7 @@ class RaspberryPi:
             awbs         = ['off','auto','incandescent','tungsten','fluorescent','indoor','daylight','cloudy']
             denoises     = ['off','cdn_off','cdn_fast','cdn_hq']
 
-            config = []
-            with open(config_file, "r") as file:
-                line = file.readline()
-                while line:
-                    config.append(line.strip())
-                    line = file.readline()
-                config = list(map(int,config))
+            config = list(map(int, Path(config_file).read_text().split()))
             mode        = config[0]
             speed       = config[1]
             gain        = config[2]
@@ -489,19 +484,15 @@ class RaspberryPi:
                     "--sharpness", str(sharpness/10),
                     "--quality", str(quality),
                     "--denoise", denoises[denoise]
-                    
             ]
-            
             if ev != 0:
-                rpistr += " --ev " + str(ev)
+                rpistr.extend(["--ev", str(ev)])
             if sspeed > 1000000 and mode == 0:
-                rpistr += " --gain " + str(gain) + " --immediate "
-            else:    
-                rpistr += " --gain " + str(gain)
-                if awb == 0:
-                    rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
-                else:
-                    rpistr += " --awb " + awbs[awb]
+                rpistr.append("--immediate")
+            elif awb == 0:
+                rpistr.extend(["--awbgains", f"{red/10},{blue/10}"])
+            else:
+                rpistr.extend(["--awb", awbs[awb]])
             
             #Execute the command
             process = subprocess.Popen(rpistr, stdout=subprocess.PIPE)
@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
-import json
+import orjson
 import queue
+import selectors
 import time
-from multiprocessing import Process, Manager
-from typing import Optional
+from multiprocessing import Process, Event, Lock, Pipe, Queue, Value
+from multiprocessing.reduction import recv_handle, send_handle
+from typing import List, Tuple
 import os
+import socket
 import requests
-from communication.android import AndroidLink, AndroidMessage
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.connection import HTTPConnection
+from communication.android import (AndroidLink, AndroidMessage, MSG_CONNECTED, MSG_FINISHED, MSG_MODE_MANUAL,
+                                   MSG_MODE_PATH, MSG_QUEUE_FINISHED, MSG_READY, MSG_RECONNECTED, MSG_RUNNING)
 from communication.stm32 import STMLink
 from consts import SYMBOL_MAP
 from logger import prepare_logger
-from settings import API_IP, API_IP_START, API_PORT
+from ring_buffer import CommandRing
+from settings import API_IP, API_IP_START, API_IP_END, API_PORT, CAMERA_RESOLUTION
 import io
 import subprocess
 from datetime import datetime
-from PIL import Image
+from pathlib import Path
+from picamera2 import Picamera2
+from libcamera import controls
 
 
 class PiAction:
@@ -31,6 +41,110 @@ class PiAction:
         return self._value
 
 
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections probe the API while idle. The pooled connection sits unused while the
+    robot drives between obstacles; the probes keep it open and find out early if the laptop went away,
+    instead of the next snap's upload timing out on a dead connection.
+    """
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 10),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+# Most messages android_sender writes to the Android link at once
+ANDROID_BATCH_SIZE = 16
+
+# Two-letter prefixes of the commands command_follower forwards to the STM32
+STM_PREFIXES = frozenset({"GO", "RW", "HL", "FW", "RR", "HR", "LL", "GG", "FA", "UL", "UR", "EN", "GF", "BW", "PW"})
+
+# Path around each obstacle, keyed by (obstacle reached, arrow direction recognised there)
+SNAP_COMMANDS = {
+    ("1", "Left"): (
+        "BW07", # ack_count = 2
+        "HL00", # ack_count = 3
+        "FW15", # ack_count = 4
+        "RR00", # ack_count = 4
+        #"FW17", # ack_count = 4 For outdoors
+        "FW15", # ack_count = 4 For indoors
+        "HL00", # ack_count = 5
+        "GF00", # ack_count = 6
+        "PW02", # ack_count = 7
+    ),
+    ("1", "Right"): (
+        "HR00", # ack_count = 2
+        "FW12", # ack_count = 3
+        "LL00", # ack_count = 4
+        "FW10", # ack_count = 4
+        "HR00", # ack_count = 5
+        "GF00", # ack_count = 6
+        "PW02", # ack_count = 7
+    ),
+    ("2", "Left"): (
+        "LL00", # ack_count = 8
+        "UR00", # ack_count = 9
+        "FW55", # ack_count = 10
+        "RR00", # ack_count = 11
+        # Car will be at the edge facing carpark
+        # Next set of commands for car to park at the carpark
+        "EN00", # ack_count = 12
+        "RR00", # ack_count = 13
+        #"FW10",
+        "LL00", # ack_count = 14
+        "GG00", # ack_count = 15
+        "FN",
+    ),
+    ("2", "Right"): (
+        "RR00", # ack_count = 8
+        "UL00", # ack_count = 9
+        "FW60", # ack_count = 10 Indoors
+        "LL00", # ack_count = 11
+        # Car will be at the edge facing carpark
+        # Next set of commands for car to park at the carpark
+        "EN00", # ack_count = 12
+        "LL00", # ack_count = 13
+        "BW08", # ack_count = 13
+        "RR00", # ack_count = 14
+        "GG00", # ack_count = 15
+        "FN",
+    ),
+}
+
+# JPEG quality sent to the image-rec API, in place of the one in CONFIG_FILE. The JPEG from the camera
+# is uploaded as is, never decoded and re-encoded on the Pi, so this is the only place it is compressed
+JPEG_QUALITY = 75
+
+# (connect, read) timeouts in seconds for API calls. snap_and_rec runs in recv_mux, which also serves
+# Android, so a hung API must not hold it up for long
+IMAGE_API_TIMEOUT = (3, 10)
+STITCH_API_TIMEOUT = (3, 30)
+
+# Directory the image-rec API is told the uploaded images came from
+IMAGE_PREFIX = "/home/pi/rpi/"
+
+# Most frames dropped after changing the camera controls, waiting for the sensor to apply them
+CONTROL_SETTLE_FRAMES = 10
+
+# libcamera settings file, one integer per line, written by PiLCConfig
+CONFIG_FILE = "/home/pi/rpi/PiLCConfig530_outdoor.txt"
+EXTNS        = ['jpg','png','bmp','rgb','yuv420','raw']
+SHUTTERS     = [-2000,-1600,-1250,-1000,-800,-640,-500,-400,-320,-288,-250,-240,-200,-160,-144,-125,-120,-100,-96,-80,-60,-50,-48,-40,-30,-25,-20,-15,-13,-10,-8,-6,-5,-4,-3,0.4,0.5,0.6,0.8,1,1.1,1.2,2,3,4,5,6,7,8,9,10,11,15,20,25,30,40,50,60,75,100,112,120,150,200,220,230,239,435]
+METERS       = ['centre','spot','average']
+AWBS         = ['off','auto','incandescent','tungsten','fluorescent','indoor','daylight','cloudy']
+DENOISES     = ['off','cdn_off','cdn_fast','cdn_hq']
+# The same settings as picamera2 controls, indexed like the lists above
+AE_METERING_MODES = [controls.AeMeteringModeEnum.CentreWeighted, controls.AeMeteringModeEnum.Spot, controls.AeMeteringModeEnum.Matrix]
+AWB_MODES    = [None, controls.AwbModeEnum.Auto, controls.AwbModeEnum.Incandescent, controls.AwbModeEnum.Tungsten, controls.AwbModeEnum.Fluorescent, controls.AwbModeEnum.Indoor, controls.AwbModeEnum.Daylight, controls.AwbModeEnum.Cloudy]
+NOISE_REDUCTION_MODES = [controls.draft.NoiseReductionModeEnum.Off, controls.draft.NoiseReductionModeEnum.Minimal, controls.draft.NoiseReductionModeEnum.Fast, controls.draft.NoiseReductionModeEnum.HighQuality]
+
+
 class RaspberryPi:
     def __init__(self):
         # Initialize logger and communication objects with Android and STM
@@ -39,68 +153,93 @@ class RaspberryPi:
         self.stm_link = STMLink()
         
 
-        # For sharing information between child processes
-        self.manager = Manager()
+        # For sharing information between child processes, backed directly by pipes and
+        # POSIX semaphores rather than a Manager server process
 
         # Set robot mode to be 1 (Path mode)
-        self.robot_mode = self.manager.Value('i', 1)
+        self.robot_mode = Value('i', 1)
 
         # Events
-        self.android_dropped = self.manager.Event()  # Set when the android link drops
+        self.android_dropped = Event()  # Set when the android link drops
         # commands will be retrieved from commands queue when this event is set
-        self.unpause = self.manager.Event()
+        self.unpause = Event()
 
         # Movement Lock
-        self.movement_lock = self.manager.Lock()
+        self.movement_lock = Lock()
 
         # Queues
-        self.android_queue = self.manager.Queue() # Messages to send to Android
-        self.rpi_action_queue = self.manager.Queue() # Messages that need to be processed by RPi
-        self.command_queue = self.manager.Queue() # Messages that need to be processed by STM32, as well as snap commands
+        self.android_queue = Queue() # Messages to send to Android
+        self.rpi_action_queue = Queue() # Messages that need to be processed by RPi
+        self.command_queue = CommandRing() # Messages that need to be processed by STM32, as well as snap commands
+
+        # For handing a reconnected Android socket over to recv_mux
+        self._mux_ctl, self._mux_ctl_child = Pipe()
+        self._selector = None
 
         # Define empty processes
-        self.proc_recv_android = None
-        self.proc_recv_stm32 = None
+        self.proc_recv = None
         self.proc_android_sender = None
         self.proc_command_follower = None
         self.proc_rpi_action = None
 
+        self.near_flag = Lock()
+        # Only used within recv_mux, so these stay plain per-process attributes
         self.ack_count = 0
-        self.near_flag = self.manager.Lock()
         self.small_direction = None
         self.big_direction = None
         self.retry_flag = False
+        # STM32 messages are dispatched on their first three characters
+        self._stm_handlers = {"ACK": self._on_ack, "SNA": self._on_snap}
+
+        # HTTP session to the API, created lazily in each process that calls the API (see http)
+        self._http = None
+        self._http_pid = None
+
+        # API host and its endpoint URLs, set by set_api() once the API is found in start()
+        self.valid_api = None
+        self._url_image = None
+        self._url_status = None
+        self._url_stitch = None
+
+        # libcamera command and settings, loaded on first capture and reloaded when the config file changes
+        self._libcam_argv = None
+        self._libcam_config = None
+        self._config_mtime = None
+
+        # Opened in the process that captures (recv_mux); libcamera-jpeg is used instead if it cannot be
+        self.camera = None
+        self._camera_mtime = None  # _config_mtime of the settings last applied to the camera
 
     def start(self):
         """Starts the RPi orchestrator"""
         try:
             # Establish Bluetooth connection with Android
             self.android_link.connect()
-            self.android_queue.put(AndroidMessage('info', 'You are connected to the RPi!'))
+            self.android_queue.put(MSG_CONNECTED)
 
             # Establish connection with STM32
             self.stm_link.connect()
 
             # Check Image Recognition and Algorithm API status
-            for endpoint in API_IP_START:
-                self.valid_api = API_IP + str(endpoint)  
+            for endpoint in range(API_IP_START, API_IP_END + 1):
+                self.set_api(API_IP + str(endpoint))
                 if self.check_api():
-                    self.logger.debug("API successfully set up at", self.valid_api)
-                    break 
+                    self.logger.debug(f"API successfully set up at {self.valid_api}")
+                    break
+            else:
+                self.logger.error(f"No API found between {API_IP}{API_IP_START} and {API_IP}{API_IP_END}")
             
             #self.small_direction = self.snap_and_rec("Small")
             #self.logger.info(f"PREINFER small direction is: {self.small_direction}")
 
             # Define child processes
-            self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
+            self.proc_recv = Process(target=self.recv_mux)
             self.proc_android_sender = Process(target=self.android_sender)
             self.proc_command_follower = Process(target=self.command_follower)
             self.proc_rpi_action = Process(target=self.rpi_action)
 
             # Start child processes
-            self.proc_recv_android.start()
-            self.proc_recv_stm32.start()
+            self.proc_recv.start()
             self.proc_android_sender.start()
             self.proc_command_follower.start()
             self.proc_rpi_action.start()
@@ -110,8 +249,8 @@ class RaspberryPi:
             ### Start up complete ###
 
             # Send success message to Android
-            self.android_queue.put(AndroidMessage('info', 'Robot is ready!'))
-            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode.value == 1 else 'manual'))
+            self.android_queue.put(MSG_READY)
+            self.android_queue.put(MSG_MODE_PATH if self.robot_mode.value == 1 else MSG_MODE_MANUAL)
             
             
             
@@ -123,8 +262,13 @@ class RaspberryPi:
 
     def stop(self):
         """Stops all processes on the RPi and disconnects gracefully with Android and STM32"""
+        # Let the sender flush what is already queued before the link goes down
+        if self.proc_android_sender is not None and self.proc_android_sender.is_alive():
+            self.android_queue.put(None)
+            self.proc_android_sender.join(timeout=1)
         self.android_link.disconnect()
         self.stm_link.disconnect()
+        self.command_queue.close()
         self.logger.info("Program exited!")
 
     def reconnect_android(self):
@@ -137,17 +281,14 @@ class RaspberryPi:
 
             self.logger.error("Android link is down!")
 
-            # Kill child processes
-            self.logger.debug("Killing android child processes")
-            self.proc_android_sender.kill()
-            self.proc_recv_android.kill()
-
-            # Wait for the child processes to finish
+            # Stop the sender. It is asked to exit rather than killed, as killing it while it
+            # waits on android_queue would leave the queue's lock held for its replacement.
+            # recv_mux keeps running for the STM32, having already stopped reading from Android
+            self.logger.debug("Stopping android sender")
+            self.android_queue.put(None)
             self.proc_android_sender.join()
-            self.proc_recv_android.join()
             assert self.proc_android_sender.is_alive() is False
-            assert self.proc_recv_android.is_alive() is False
-            self.logger.debug("Android child processes killed")
+            self.logger.debug("Android sender stopped")
 
             # Clean up old sockets
             self.android_link.disconnect()
@@ -155,228 +296,448 @@ class RaspberryPi:
             # Reconnect
             self.android_link.connect()
 
-            # Recreate Android processes
-            self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_android_sender = Process(target=self.android_sender)
+            # Hand the new connection over to recv_mux
+            send_handle(self._mux_ctl, self.android_link.client_sock.fileno(), self.proc_recv.pid)
 
-            # Start previously killed processes
-            self.proc_recv_android.start()
+            # Recreate the sender, which inherits the new connection
+            self.proc_android_sender = Process(target=self.android_sender)
             self.proc_android_sender.start()
 
             self.logger.info("Android child processes restarted")
-            self.android_queue.put(AndroidMessage("info", "You are reconnected!"))
-            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode.value == 1 else 'manual'))
+            self.android_queue.put(MSG_RECONNECTED)
+            self.android_queue.put(MSG_MODE_PATH if self.robot_mode.value == 1 else MSG_MODE_MANUAL)
 
             self.android_dropped.clear()
             
         
-    def recv_android(self) -> None:
+    @property
+    def http(self) -> requests.Session:
         """
-        [Child Process] Processes the messages received from Android
+        Keep-alive HTTP session to the API, so repeated calls reuse one TCP connection.
+        Each process gets its own, as a pooled socket must not be shared across a fork.
         """
-       
-        while True:
-            msg_str: Optional[str] = None
+        if self._http is None or self._http_pid != os.getpid():
+            self._http = requests.Session()
+            self._http.mount('http://', KeepAliveAdapter(pool_connections=2, pool_maxsize=2))
+            self._http.headers.update({'Connection': 'keep-alive'})
+            self._http_pid = os.getpid()
+        return self._http
+
+    def _pin(self, core: int, niceness: int = 0) -> None:
+        """
+        Pins the calling child process to one CPU core, so it is not migrated between cores and keeps its cache warm,
+        and optionally raises its scheduling priority.
+        :param core: the core to run on (wraps around on boards with fewer cores)
+        :param niceness: amount to change the nice value by, negative for a higher priority
+        """
+        os.sched_setaffinity(0, {core % os.cpu_count()})
+        if niceness:
             try:
-                msg_str = self.android_link.recv()
-            except OSError:
-                self.android_dropped.set()
-                self.logger.debug("Event set: Android connection dropped")
+                os.nice(niceness)
+            except PermissionError:
+                self.logger.warning(f"Not permitted to change the priority of process {os.getpid()}")
 
-            # If an error occurred in recv()
-            if msg_str is None:
-                continue
+    def _load_libcam_config(self) -> Tuple[List[str], dict, float]:
+        """
+        Reads the camera settings from CONFIG_FILE and builds the libcamera-jpeg command from them.
+        :return: the command, the parsed settings, and the modification time of the file they were read from
+        """
+        mtime = os.stat(CONFIG_FILE).st_mtime
+        config = list(map(int, Path(CONFIG_FILE).read_text().split()))
+        settings = {
+            "mode":        config[0],
+            "speed":       config[1],
+            "gain":        config[2],
+            "brightness":  config[3],
+            "contrast":    config[4],
+            "red":         config[6],
+            "blue":        config[7],
+            "ev":          config[8],
+            "extn":        config[15],
+            "saturation":  config[19],
+            "meter":       config[20],
+            "awb":         config[21],
+            "sharpness":   config[22],
+            "denoise":     config[23],
+            "quality":     config[24],
+        }
+
+        shutter = SHUTTERS[settings["speed"]]
+        if shutter < 0:
+            shutter = abs(1/shutter)
+        sspeed = int(shutter * 1000000)
+        if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
+            sspeed +=1
+        settings["sspeed"] = sspeed
+
+        argv = [
+                    "libcamera-jpeg" ,
+                    "-e", EXTNS[settings["extn"]],
+                    "-n",
+                    "-t", "500",
+                    "-o", "-",
+                    "--brightness", str(settings["brightness"]/100),
+                    "--contrast", str(settings["contrast"]/100),
+                    "--shutter", str(sspeed),
+                    "--gain", str(settings["gain"]),
+                    "--metering",  METERS[settings["meter"]],
+                    "--saturation", str(settings["saturation"]/10),
+                    "--sharpness", str(settings["sharpness"]/10),
+                    "--quality", str(JPEG_QUALITY),
+                    "--denoise", DENOISES[settings["denoise"]]
+        ]
+        if settings["ev"] != 0:
+            argv.extend(["--ev", str(settings["ev"])])
+        if sspeed > 1000000 and settings["mode"] == 0:
+            argv.append("--immediate")
+        elif settings["awb"] == 0:
+            argv.extend(["--awbgains", f'{settings["red"]/10},{settings["blue"]/10}'])
+        else:
+            argv.extend(["--awb", AWBS[settings["awb"]]])
+        return argv, settings, mtime
+
+    def _reload_libcam_config(self) -> None:
+        """
+        Loads the camera settings, only re-reading CONFIG_FILE when it has been modified since.
+        """
+        if self._libcam_argv is None or os.stat(CONFIG_FILE).st_mtime != self._config_mtime:
+            self._libcam_argv, self._libcam_config, self._config_mtime = self._load_libcam_config()
+            self.logger.debug(f"Loaded camera settings from {CONFIG_FILE}")
 
-            message: dict = json.loads(msg_str)
+    def _libcam_command(self) -> List[str]:
+        """
+        The libcamera-jpeg command to capture with.
+        :return: the command, writing the image to stdout
+        """
+        self._reload_libcam_config()
+        return self._libcam_argv
 
-            ## Command: Start Moving ##
-            if message['cat'] == "control":
-                if message['value'] == "start":
-        
-                    if not self.check_api():
-                        self.logger.error("API is down! Start command aborted.")
-
-                    self.clear_queues()
-                    # Go forward to the small block
-                    self.command_queue.put("GO00") # ack_count = 1
-                    self.command_queue.put("RW01") # stm will send back SNAP1
-                    #self.near_flag.acquire() 
-                    
-                    # # Small object direction detection
-                    # self.small_direction = self.snap_and_rec("small")
-                    # self.logger.info(f"HERE small direction is: {self.small_direction}")
-                    # if self.small_direction == "Left Arrow": 
-                    #     self.command_queue.put("OB01") # ack_count = 3
-                    #     self.command_queue.put("UL00") # ack_count = 5
-                    # elif self.small_direction == "Right Arrow":
-                    #     self.command_queue.put("OB01") # ack_count = 3
-                    #     self.command_queue.put("UR00") # ack_count = 5
-
-                    # elif self.small_direction == None or self.small_direction == 'None':
-                    #     self.logger.info("Acquiring near_flag log")
-                    #     self.near_flag.acquire()             
-                        
-                    #     self.command_queue.put("OB01") # ack_count = 3
-                        
-                    self.logger.info("Start command received, starting robot on task 2!")
-                    self.android_queue.put(AndroidMessage('status', 'running'))
-
-                    # Commencing path following | Main trigger to start movement #
-                    self.unpause.set()
-                    
-    def recv_stm(self) -> None:
+    def initialize_camera(self) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        Opens the camera once and keeps it streaming, so that each snap only has to grab a frame
+        instead of starting libcamera-jpeg. Call from the process that captures.
+        The settings from CONFIG_FILE are part of the configuration, so they apply from the very first frame.
         """
+        width, height = CAMERA_RESOLUTION
+        self._reload_libcam_config()
+        self.camera = Picamera2()
+        try:
+            still_config = self.camera.create_still_configuration(
+                main={"size": (width, height), "format": "RGB888"}, buffer_count=2,
+                controls=self._camera_controls(self._libcam_config))
+            self.camera.configure(still_config)
+            self._camera_mtime = self._config_mtime
+            self.camera.options["quality"] = JPEG_QUALITY
+            self.camera.start()
+        except Exception:
+            # Do not leave a half-initialized camera holding the device
+            self.close_camera()
+            raise
+        self.logger.info("Camera initialized.")
+
+    def close_camera(self) -> None:
+        """
+        Stops and releases the camera, if it is open.
+        """
+        if self.camera is None:
+            return
+        try:
+            self.camera.stop()
+            self.camera.close()
+        finally:
+            self.camera = None
+
+    def _camera_controls(self, settings: dict) -> dict:
+        """
+        Translates the libcamera-jpeg settings from CONFIG_FILE into picamera2 controls.
+        :param settings: the settings parsed by _load_libcam_config
+        :return: the controls to set on the camera
+        """
+        camera_controls = {
+            "ExposureTime": settings["sspeed"],
+            "Brightness": settings["brightness"]/100,
+            "Contrast": settings["contrast"]/100,
+            "Saturation": settings["saturation"]/10,
+            "Sharpness": settings["sharpness"]/10,
+            "ExposureValue": float(settings["ev"]),
+            "AeMeteringMode": AE_METERING_MODES[settings["meter"]],
+            "NoiseReductionMode": NOISE_REDUCTION_MODES[settings["denoise"]],
+        }
+        # A gain of 0 leaves it to the AGC, as with libcamera-jpeg --gain 0
+        if settings["gain"] != 0:
+            camera_controls["AnalogueGain"] = float(settings["gain"])
+        if settings["awb"] == 0:
+            camera_controls["AwbEnable"] = False
+            camera_controls["ColourGains"] = (settings["red"]/10, settings["blue"]/10)
+        else:
+            camera_controls["AwbEnable"] = True
+            camera_controls["AwbMode"] = AWB_MODES[settings["awb"]]
+        return camera_controls
+
+    def _wait_for_controls(self, camera_controls: dict) -> None:
+        """
+        Drops frames until the camera reports the given exposure and gain, as frames already queued
+        and the sensor's control delay mean the next few frames are still taken with the old settings.
+        :param camera_controls: the controls just set on the camera
+        """
+        # Values outside what the sensor supports are clamped to its limits
+        min_exposure, max_exposure, _ = self.camera.camera_controls["ExposureTime"]
+        exposure = min(max(camera_controls["ExposureTime"], min_exposure), max_exposure)
+        gain = camera_controls.get("AnalogueGain")
+        if gain is not None:
+            min_gain, max_gain, _ = self.camera.camera_controls["AnalogueGain"]
+            gain = min(max(gain, min_gain), max_gain)
+        for _ in range(CONTROL_SETTLE_FRAMES):
+            metadata = self.camera.capture_metadata()
+            # The sensor rounds exposure to whole lines and gain to its own steps
+            if abs(metadata["ExposureTime"] - exposure) > max(100, exposure * 0.02):
+                continue
+            # No gain to wait for when the AGC picks it
+            if gain is None or abs(metadata["AnalogueGain"] - gain) <= max(0.1, gain * 0.05):
+                return
+        self.logger.warning(f"Camera settings not applied after {CONTROL_SETTLE_FRAMES} frames, capturing anyway")
+
+    def capture_image(self) -> io.BytesIO:
+        """
+        Captures a JPEG with the open camera, applying the settings from CONFIG_FILE if they changed.
+        :return: the encoded image, ready to be read
+        """
+        self._reload_libcam_config()
+        if self._camera_mtime != self._config_mtime:
+            camera_controls = self._camera_controls(self._libcam_config)
+            self.camera.set_controls(camera_controls)
+            self._wait_for_controls(camera_controls)
+            self._camera_mtime = self._config_mtime
+        # Grab a frame from the already running camera, instead of spawning libcamera-jpeg for each snap
+        image_buf = io.BytesIO()
+        self.camera.capture_file(image_buf, format="jpeg")
+        image_buf.seek(0)
+        return image_buf
+
+    def recv_mux(self) -> None:
+        """
+        [Child Process] Receives and processes messages from both Android and the STM32, waiting on the two links at once
+        """
+        # Latency critical, together with command_follower
+        self._pin(1, niceness=-5)
+        # Snaps are taken from this process, so the camera is opened here
+        try:
+            self.initialize_camera()
+        except Exception as e:
+            self.logger.warning(f"Could not open the camera, capturing with libcamera-jpeg instead: {e}")
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.stm_link.fileno(), selectors.EVENT_READ, self._on_stm_readable)
+        self._selector.register(self.android_link.client_sock, selectors.EVENT_READ, self._on_android_readable)
+        self._selector.register(self._mux_ctl_child, selectors.EVENT_READ, self._on_android_reconnected)
         while True:
+            for key, _ in self._selector.select():
+                key.data(key.fileobj)
 
-            message: str = self.stm_link.recv()
-            # Acknowledgement from STM32
-            if message.startswith("ACK"):
-                self.ack_count += 1
-                # Release movement lock
-                try:
-                    self.movement_lock.release()
-                except Exception:
-                    self.logger.warning("Tried to release a released lock!")
-                self.logger.info(f"ACK from STM32 received, ACK count now:{self.ack_count}")   
-
-            # Robot in position to do image rec
-            elif message.startswith("SNAP"):
-                self.logger.info("Sending API requests to image server")
-                _, obstacle_id = message.split('_')
-                if message.endswith("1"): # Reached first obstacle
-                    self.logger.info("Robot reached first obstacle!")
-                    self.small_direction = self.snap_and_rec("small")
+    def _on_stm_readable(self, _fd: int) -> None:
+        """
+        [recv_mux] Handles everything the STM32 has sent so far
+        """
+        for message in self.stm_link.recv_available():
+            self._stm_handlers.get(message[:3], self._on_unknown)(message)
+
+    def _on_android_readable(self, sock) -> None:
+        """
+        [recv_mux] Handles a message from Android, or stops listening to it if the link dropped
+        """
+        # An event for the socket replaced by _on_android_reconnected, from the same select() call
+        if sock is not self.android_link.client_sock:
+            return
+        try:
+            msg_str = self.android_link.recv()
+        except OSError:
+            self._drop_android_sock()
+            self.android_dropped.set()
+            self.logger.debug("Event set: Android connection dropped")
+            return
+
+        # Only whitespace was received
+        if not msg_str:
+            self.logger.debug("Ignored blank message from Android")
+            return
+
+        try:
+            message: dict = orjson.loads(msg_str)
+        except orjson.JSONDecodeError:
+            self.logger.warning(f"Ignored malformed message from Android: {msg_str}")
+            return
+        self._on_android(message)
+
+    def _on_android_reconnected(self, conn) -> None:
+        """
+        [recv_mux] Starts listening to the new Android connection made by reconnect_android
+        """
+        fd = recv_handle(conn)
+        self._drop_android_sock()
+        self.android_link.client_sock = socket.socket(fileno=fd)
+        self._selector.register(self.android_link.client_sock, selectors.EVENT_READ, self._on_android_readable)
+        self.logger.debug("Listening to the reconnected Android link")
+
+    def _drop_android_sock(self) -> None:
+        """
+        [recv_mux] Stops listening to the current Android connection, if it still is, and closes this process' copy of it
+        """
+        sock = self.android_link.client_sock
+        if sock is None:
+            return
+        try:
+            self._selector.unregister(sock)
+        except KeyError:
+            pass
+        sock.close()
+        self.android_link.client_sock = None
+
+    def _on_android(self, message: dict) -> None:
+        """
+        [recv_mux] Processes a message received from Android
+        """
+        ## Command: Start Moving ##
+        if message['cat'] == "control":
+            if message['value'] == "start":
+    
+                if not self.check_api():
+                    self.logger.error("API is down! Start command aborted.")
+
+                self.clear_queues()
+                # Go forward to the small block
+                self.command_queue.push("GO00") # ack_count = 1
+                self.command_queue.push("RW01") # stm will send back SNAP1
+                #self.near_flag.acquire() 
+                
+                # # Small object direction detection
+                # self.small_direction = self.snap_and_rec("small")
+                # self.logger.info(f"HERE small direction is: {self.small_direction}")
+                # if self.small_direction == "Left Arrow": 
+                #     self.command_queue.push("OB01") # ack_count = 3
+                #     self.command_queue.push("UL00") # ack_count = 5
+                # elif self.small_direction == "Right Arrow":
+                #     self.command_queue.push("OB01") # ack_count = 3
+                #     self.command_queue.push("UR00") # ack_count = 5
+
+                # elif self.small_direction == None or self.small_direction == 'None':
+                #     self.logger.info("Acquiring near_flag log")
+                #     self.near_flag.acquire()             
                     
-                    if self.small_direction == "Left": 
-                        # When we retry, we move back to original position after image rec
-                        #if self.retry_flag is True:
-                            #self.command_queue.put("FW10")
-                            #self.retry_flag = False
-                        self.command_queue.put("BW07") # ack_count = 2
-                        self.command_queue.put("HL00") # ack_count = 3
-                        self.command_queue.put("FW15") # ack_count = 4
-                        self.command_queue.put("RR00") # ack_count = 4
-                        #self.command_queue.put("FW17") # ack_count = 4 For outdoors
-                        self.command_queue.put("FW15") # ack_count = 4 For indoors
-                        self.command_queue.put("HL00") # ack_count = 5
-                        self.command_queue.put("GF00") # ack_count = 6
-                        self.command_queue.put("PW02") # ack_count = 7
-                        self.logger.info("Commands pushed to queue!")
-                    elif self.small_direction == "Right":
-                        # When we retry, we move back to original position after image rec
-                        #if self.retry_flag is True:
-                            #self.command_queue.put("FW10")
-                            #self.retry_flag = False
-                        self.command_queue.put("HR00") # ack_count = 2
-                        self.command_queue.put("FW12") # ack_count = 3
-                        
-                        self.command_queue.put("LL00") # ack_count = 4
-                        self.command_queue.put("FW10") # ack_count = 4
-                        self.command_queue.put("HR00") # ack_count = 5
-                        self.command_queue.put("GF00") # ack_count = 6
-                        self.command_queue.put("PW02") # ack_count = 7
-                        self.logger.info("Commands pushed to queue!")
-                    # Retry logic: If image rec fail, robot will reverse then send back SNAP1
-                    #else: # We dont care about non-left/right arrow
-                        #self.logger.debug("Error detecting. Retry again.")
-                        #self.retry_flag = True
-                        #command = "FA0" + obstacle_id
-                        #self.command_queue.put(command)
-                if message.endswith("2"): # Reached second obstacle
-                    self.logger.info("Robot reached second obstacle!")
-                    self.big_direction = self.snap_and_rec("big")
-                    #self.logger.debug("Big Direction:", self.big_direction)
-                    if self.big_direction == "Left": 
-                        # When we retry, we move back to original position after image rec
-                        #if self.retry_flag is True:
-                            #self.command_queue.put("FW10")
-                            #self.retry_flag = False
-                        self.command_queue.put("LL00") # ack_count = 8
-                        self.command_queue.put("UR00") # ack_count = 9
-                        self.command_queue.put("FW55") # ack_count = 10
-                        self.command_queue.put("RR00") # ack_count = 11
-                        
-                        # Car will be at the edge facing carpark
-                        # Next set of commands for car to park at the carpark
-                        self.command_queue.put("EN00") # ack_count = 12
-                        self.command_queue.put("RR00") # ack_count = 13
-                        #self.command_queue.put("FW10")
-                        self.command_queue.put("LL00") # ack_count = 14
-                        self.command_queue.put("GG00") # ack_count = 15
-                        self.command_queue.put("FN")
+                #     self.command_queue.push("OB01") # ack_count = 3
                     
-                    elif self.big_direction == "Right":
-                        # When we retry, we move back to original position after image rec
-                        #if self.retry_flag is True:
-                            #self.command_queue.put("FW10")
-                            #self.retry_flag = False
-                        self.command_queue.put("RR00") # ack_count = 8
-                        self.command_queue.put("UL00") # ack_count = 9
-                        self.command_queue.put("FW60") # ack_count = 10 Indoors
-                        self.command_queue.put("LL00") # ack_count = 11
-                        
-                        # Car will be at the edge facing carpark
-                        # Next set of commands for car to park at the carpark
-                        self.command_queue.put("EN00") # ack_count = 12
-                        self.command_queue.put("LL00") # ack_count = 13
-                        self.command_queue.put("BW08") # ack_count = 13
-                        self.command_queue.put("RR00") # ack_count = 14
-                        self.command_queue.put("GG00") # ack_count = 15
-                        self.command_queue.put("FN") 
-                    # Retry logic: If image rec fail, robot will reverse then send back SNAP1
-                    #else: # We dont care about non-left/right arrow
-                        #self.retry_flag = True
-                        #command = "FA0" + obstacle_id
-                        #self.command_queue.put(command)
-                try:
-                    self.movement_lock.release()
-                    self.logger.info("Movement lock released")
-                except Exception:
-                    self.logger.warning("Tried to release a released lock!")
-            else:
-                self.logger.warning(
-                    f"Ignored unknown message from STM: {message}")
+                self.logger.info("Start command received, starting robot on task 2!")
+                self.android_queue.put(MSG_RUNNING)
+
+                # Commencing path following | Main trigger to start movement #
+                self.unpause.set()
+
+    def _on_ack(self, message: str) -> None:
+        """
+        [recv_mux] Acknowledgement from STM32: count it and release the movement lock
+        """
+        self.ack_count += 1
+        # Release movement lock
+        try:
+            self.movement_lock.release()
+        except Exception:
+            self.logger.warning("Tried to release a released lock!")
+        self.logger.info("ACK from STM32 received, ACK count now:%d", self.ack_count)
+
+    def _on_snap(self, message: str) -> None:
+        """
+        [recv_mux] Robot in position to do image rec: snap, then queue the path around the obstacle
+        """
+        self.logger.info("Sending API requests to image server")
+        _, obstacle_id = message.split('_')
+        obstacle = message[-1]
+        direction = None
+        if obstacle == "1": # Reached first obstacle
+            self.logger.info("Robot reached first obstacle!")
+            self.small_direction = direction = self.snap_and_rec("small")
+        elif obstacle == "2": # Reached second obstacle
+            self.logger.info("Robot reached second obstacle!")
+            self.big_direction = direction = self.snap_and_rec("big")
+            #self.logger.debug("Big Direction:", self.big_direction)
+
+        # When we retry, we move back to original position after image rec
+        #if self.retry_flag is True:
+            #self.command_queue.push("FW10")
+            #self.retry_flag = False
+        commands = SNAP_COMMANDS.get((obstacle, direction))
+        if commands:
+            self.command_queue.push_many(commands)
+            self.logger.info("Commands pushed to queue!")
+        # Retry logic: If image rec fail, robot will reverse then send back SNAP1
+        #else: # We dont care about non-left/right arrow
+            #self.logger.debug("Error detecting. Retry again.")
+            #self.retry_flag = True
+            #command = "FA0" + obstacle_id
+            #self.command_queue.push(command)
+        try:
+            self.movement_lock.release()
+            self.logger.info("Movement lock released")
+        except Exception:
+            self.logger.warning("Tried to release a released lock!")
+
+    def _on_unknown(self, message: str) -> None:
+        self.logger.warning(
+            f"Ignored unknown message from STM: {message}")
 
     def android_sender(self) -> None:
+        """
+        [Child Process] Sends queued messages to Android, writing out every message already
+        waiting in the queue at once rather than one at a time
+        """
+        self._pin(3)
         while True:
-            try:
-                message: AndroidMessage = self.android_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
+            # Sleep until there is something to send, then take whatever else has queued up
+            messages = [self.android_queue.get()]
+            while len(messages) < ANDROID_BATCH_SIZE and messages[-1] is not None:
+                try:
+                    messages.append(self.android_queue.get_nowait())
+                except queue.Empty:
+                    break
 
-            try:
-                self.android_link.send(message)
-            except OSError:
-                self.android_dropped.set()
-                self.logger.debug("Event set: Android dropped")
+            # Asked to exit by reconnect_android, once the messages before it are sent
+            exiting = messages[-1] is None
+            if exiting:
+                messages.pop()
+
+            if messages:
+                try:
+                    self.android_link.send_batch(messages)
+                except OSError:
+                    self.android_dropped.set()
+                    self.logger.debug("Event set: Android dropped")
+            if exiting:
+                return
 
     def command_follower(self) -> None:
+        self._pin(2, niceness=-5)
         
         while True:
-            command: str = self.command_queue.get()
+            command: str = self.command_queue.pop()
             self.unpause.wait()
             self.logger.info("Unpuase has been set!")
             self.movement_lock.acquire()
-            stm32_prefixes = ("GO", "RW", "HL", "FW", "RR", "HR", "LL", "GG", "FA", "UL", "UR", "EN", "GF", "BW", "PW")
-            if command.startswith(stm32_prefixes):
+            if command[:2] in STM_PREFIXES:
                 self.stm_link.send(command)
             elif command == "FN":
                 self.unpause.clear()
                 self.movement_lock.release()
                 self.logger.info("Commands queue finished.")
-                self.android_queue.put(AndroidMessage("info", "Commands queue finished."))
-                self.android_queue.put(AndroidMessage("status", "finished"))
+                self.android_queue.put(MSG_QUEUE_FINISHED)
+                self.android_queue.put(MSG_FINISHED)
                 #self.rpi_action_queue.put(PiAction(cat="stitch", value=""))
                 self.request_stitch()
             else:
                 raise Exception(f"Unknown command: {command}")
 
     def rpi_action(self):
+        self._pin(0)
         while True:
             action: PiAction = self.rpi_action_queue.get()
-            self.logger.debug(f"PiAction retrieved from queue: {action.cat} {action.value}")
+            self.logger.debug("PiAction retrieved from queue: %s %s", action.cat, action.value)
             if action.cat == "snap": self.snap_and_rec(obstacle_id=action.value)
             elif action.cat == "stitch": self.request_stitch()
 
@@ -387,145 +748,53 @@ class RaspberryPi:
         :param obstacle_id: the current obstacle ID
         """
         
+        start_time = time.perf_counter()
+        image = None
+        process = None
+        if self.camera is not None:
+            try:
+                image = self.capture_image()
+            except Exception as e:
+                self.logger.error(f"Camera capture failed, retrying with libcamera-jpeg: {e}")
+                self.close_camera()
+        if image is None:
+            # Start exposing first: the camera runs in its own process, so everything below until the
+            # image is read overlaps with the capture instead of delaying it
+            process = subprocess.Popen(self._libcam_command(), stdout=subprocess.PIPE)
+
         self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
         self.android_queue.put(AndroidMessage("info", f"Capturing image for obstacle id: {obstacle_id}"))
         signal = "C"
-        url = f"http://{API_IP}:{API_PORT}/image"
-        filename = f"{int(time.time())}_{obstacle_id}.jpg"
-        
-        
-        config_file = "/home/pi/rpi/PiLCConfig530_outdoor.txt"
-
-        extns        = ['jpg','png','bmp','rgb','yuv420','raw']
-        shutters     = [-2000,-1600,-1250,-1000,-800,-640,-500,-400,-320,-288,-250,-240,-200,-160,-144,-125,-120,-100,-96,-80,-60,-50,-48,-40,-30,-25,-20,-15,-13,-10,-8,-6,-5,-4,-3,0.4,0.5,0.6,0.8,1,1.1,1.2,2,3,4,5,6,7,8,9,10,11,15,20,25,30,40,50,60,75,100,112,120,150,200,220,230,239,435]
-        meters       = ['centre','spot','average']
-        awbs         = ['off','auto','incandescent','tungsten','fluorescent','indoor','daylight','cloudy']
-        denoises     = ['off','cdn_off','cdn_fast','cdn_hq']
-
-        config = []
-        with open(config_file, "r") as file:
-            line = file.readline()
-            while line:
-                config.append(line.strip())
-                line = file.readline()
-            config = list(map(int,config))
-        mode        = config[0]
-        speed       = config[1]
-        gain        = config[2]
-        brightness  = config[3]
-        contrast    = config[4]
-        red         = config[6]
-        blue        = config[7]
-        ev          = config[8]
-        extn        = config[15]
-        saturation  = config[19]
-        meter       = config[20]
-        awb         = config[21]
-        sharpness   = config[22]
-        denoise     = config[23]
-        quality     = config[24]
-        
-        #retry_count = 0
-        
-        #while True:
-        
-            #retry_count += 1
-        
-        shutter = shutters[speed]
-        if shutter < 0:
-            shutter = abs(1/shutter)
-        sspeed = int(shutter * 1000000)
-        if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
-            sspeed +=1
-                
-        """rpistr = "libcamera-still -e " + extns[extn] + " -n -t 100 -o " + filename
-        rpistr += " --brightness " + str(brightness/100) + " --contrast " + str(contrast/100)
-        rpistr += " --shutter " + str(sspeed)
-        if ev != 0:
-            rpistr += " --ev " + str(ev)
-        if sspeed > 1000000 and mode == 0:
-            rpistr += " --gain " + str(gain) + " --immediate "
-        else:    
-            rpistr += " --gain " + str(gain)
-            if awb == 0:
-                rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
-            else:
-                rpistr += " --awb " + awbs[awb]
-        rpistr += " --metering " + meters[meter]
-        rpistr += " --saturation " + str(saturation/10)
-        rpistr += " --sharpness " + str(sharpness/10)
-        rpistr += " --quality " + str(quality)
-        rpistr += " --denoise "    + denoises[denoise]
-        rpistr += " --metadata - --metadata-format txt >> PiLibtext.txt"
-
-        os.system(rpistr)"""
-        
-        start_time = time.perf_counter()
-        rpistr = [
-                    "libcamera-jpeg" ,
-                    "-e", extns[extn],
-                    "-n",
-                    "-t", "500",
-                    "-o", "-",
-                    "--brightness", str(brightness/100),
-                    "--contrast", str(contrast/100),
-                    "--shutter", str(sspeed),
-                    "--gain", str(gain),
-                    "--metering",  meters[meter],
-                    "--saturation", str(saturation/10),
-                    "--sharpness", str(sharpness/10),
-                    "--quality", str(quality),
-                    "--denoise", denoises[denoise]
-                    
-        ]
-            
-        if ev != 0:
-            rpistr += " --ev " + str(ev)
-        if sspeed > 1000000 and mode == 0:
-            rpistr += " --gain " + str(gain) + " --immediate "
-        else:    
-            rpistr += " --gain " + str(gain)
-            if awb == 0:
-                rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
-            else:
-                rpistr += " --awb " + awbs[awb]
-            
-        #Execute the command
-        process = subprocess.Popen(rpistr, stdout=subprocess.PIPE)
-        image_data, _ = process.communicate()
-        if process.returncode != 0:
-            self.logger.error(f"Libcamera-still failed.")
-            
-            
-        #img = Image.open(io.BytesIO(image_data))
-        #compressed_image_io = io.BytesIO()
-        #img.save(compressed_image_io, format="JPEG", quality=85)
-        
-        #compressed_image_io.seek(0)
-            
-            
+
+        if process is not None:
+            # The multipart encoder needs the image's length up front, which a pipe cannot give,
+            # so the JPEG is taken from libcamera-jpeg in one read
+            image = io.BytesIO(process.stdout.read())
+            process.stdout.close()
+            process.wait()
+            if process.returncode != 0:
+                self.logger.error(f"libcamera-jpeg failed with exit code {process.returncode}")
+
         self.logger.debug("Requesting from image API")
-        # Proceed with sending the image to the API
-        url = f"http://{self.valid_api}:{API_PORT}/image"
-        #img_file = {'files': (file_path, open(file_path, 'rb'), 'image/jpeg')}
-        img_file = {"files": (f'/home/pi/rpi/{datetime.now().strftime("%Y%m%d_%H%M%S")}_{obstacle_id}.jpg', io.BytesIO(image_data), 'image/jpeg')}
-        
-        #img_file = {"files": (f'/home/pi/rpi/{datetime.now().strftime("%Y%m%d_%H%M%S")}_{obstacle_id}.jpg', compressed_image_io, 'image/jpeg')}
-        data = {'obstacle_id': str(obstacle_id), 'signal': signal}
-        end_time = time.perf_counter()
-        self.logger.info(f"Total time taken: {end_time - start_time:.2f} seconds")
+        # Stream the multipart body from the encoded image instead of building a copy of it in memory
+        body = MultipartEncoder(fields={'obstacle_id': str(obstacle_id), 'signal': signal,
+                                        'files': (f'{IMAGE_PREFIX}{datetime.now().strftime("%Y%m%d_%H%M%S")}_{obstacle_id}.jpg', image, 'image/jpeg')})
         try:
-            response = requests.post(url, files=img_file, data=data)
+            response = self.http.post(self._url_image, data=body, headers={'Content-Type': body.content_type},
+                                      timeout=IMAGE_API_TIMEOUT)
         except Exception as e:
             self.logger.error(f"Error with image API: {e}")
             return "Right"
-        img_file['files'][1].close()
+        finally:
+            image.close()
+        end_time = time.perf_counter()
+        self.logger.info(f"Total time taken: {end_time - start_time:.2f} seconds")
 
         if response.status_code != 200:
             self.logger.error("Something went wrong when requesting path from image-rec API. Please try again.")
             return "Right"
 
-        results = json.loads(response.content)
+        results = orjson.loads(response.content)
 
             # Higher brightness retry
             
@@ -547,17 +816,32 @@ class RaspberryPi:
         return results["class_name"] if results["class_name"] != "NA" else "Right"
 
     def request_stitch(self):
-        url = f"http://{self.valid_api}:{API_PORT}/stitch"
-        response = requests.get(url)
+        try:
+            response = self.http.get(self._url_stitch, timeout=STITCH_API_TIMEOUT)
+        except requests.RequestException as e:
+            self.logger.error(f"Error requesting stitch from the API: {e}")
+            return
         if response.status_code != 200:
             self.logger.error("Something went wrong when requesting stitch from the API.")
             return
         self.logger.info("Images stitched!")
 
     def clear_queues(self):
-        while not self.command_queue.empty():
-            self.command_queue.get()
+        """Drops all pending commands, in constant time and safely alongside other processes pushing to the ring"""
+        self.command_queue.clear()
+
 
+    def set_api(self, host: str) -> None:
+        """Points all API requests at the given host, building its endpoint URLs once
+
+        Args:
+            host (str): IP address of the API server
+        """
+        self.valid_api = host
+        base = f"http://{host}:{API_PORT}"
+        self._url_image = base + "/image"
+        self._url_status = base + "/status"
+        self._url_stitch = base + "/stitch"
 
     def check_api(self) -> bool:
         """Check whether image recognition and algorithm API server is up and running
@@ -566,9 +850,8 @@ class RaspberryPi:
             bool: True if running, False if not.
         """
         # Check image recognition API
-        url = f"http://{self.valid_api}:{API_PORT}/status"
         try:
-            response = requests.get(url, timeout=1)
+            response = self.http.get(self._url_status, timeout=1)
             if response.status_code == 200:
                 self.logger.debug("API is up!")
                 return True